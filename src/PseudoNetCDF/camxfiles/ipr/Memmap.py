@@ -13,28 +13,99 @@ __doc__ = """
 """
 # Distribution packages
 import unittest
-import struct
 import functools
-from warnings import warn
+from collections import OrderedDict
 
 # Site-Packages
-from numpy import zeros, dtype, memmap, char
+from numpy import empty, dtype, memmap, ascontiguousarray
 
 # This Package modules
 from PseudoNetCDF.conventions.ioapi import add_cf_from_ioapi
 from PseudoNetCDF.camxfiles.timetuple import timeadd, timerange
-from PseudoNetCDF.camxfiles.util import cartesian
 from PseudoNetCDF.camxfiles.units import get_uamiv_units
+from PseudoNetCDF.camxfiles.util import advise_sequential
 from PseudoNetCDF.camxfiles.FortranFileUtil import OpenRecordFile
 from PseudoNetCDF.sci_var import PseudoNetCDFFile, PseudoNetCDFVariable
 from PseudoNetCDF.sci_var import PseudoNetCDFVariables
 from PseudoNetCDF.ArrayTransforms import ConvertCAMxTime
 
-# for use in identifying uncaught nan
-listnan = struct.unpack('>f', b'\xff\xc0\x00\x00')[0]
-checkarray = zeros((1,), 'f')
-checkarray[0] = listnan
-array_nan = checkarray[0]
+_IPR_DTYPE_24 = dtype(
+    dict(
+        names=['SPAD', 'DATE', 'TIME', 'SPC', 'PAGRID', 'NEST', 'I', 'J', 'K',
+               'INIT', 'CHEM', 'EMIS', 'PTEMIS', 'PIG', 'WADV', 'EADV',
+               'SADV', 'NADV', 'BADV', 'TADV', 'DIL', 'WDIF', 'EDIF', 'SDIF',
+               'NDIF', 'BDIF', 'TDIF', 'DDEP', 'WDEP', 'AERCHEM', 'FCONC',
+               'UCNV', 'AVOL', 'EPAD'],
+        formats=['>i', '>i', '>f', '>S10', '>i', '>i', '>i', '>i', '>i',
+                 '>f', '>f', '>f', '>f', '>f', '>f', '>f', '>f', '>f', '>f',
+                 '>f', '>f', '>f', '>f', '>f', '>f', '>f', '>f', '>f', '>f',
+                 '>f', '>f', '>f', '>f', '>i']))
+
+_IPR_DTYPE_26 = dtype(
+    dict(
+        names=['SPAD', 'DATE', 'TIME', 'SPC', 'PAGRID', 'NEST', 'I', 'J', 'K',
+               'INIT', 'CHEM', 'EMIS', 'PTEMIS', 'PIG', 'WADV', 'EADV',
+               'SADV', 'NADV', 'BADV', 'TADV', 'DIL', 'WDIF', 'EDIF', 'SDIF',
+               'NDIF', 'BDIF', 'TDIF', 'DDEP', 'WDEP', 'INORGACHEM',
+               'ORGACHEM', 'AQACHEM', 'FCONC', 'UCNV', 'AVOL', 'EPAD'],
+        formats=['>i', '>i', '>f', '>S10', '>i', '>i', '>i', '>i', '>i',
+                 '>f', '>f', '>f', '>f', '>f', '>f', '>f', '>f', '>f', '>f',
+                 '>f', '>f', '>f', '>f', '>f', '>f', '>f', '>f', '>f', '>f',
+                 '>f', '>f', '>f', '>f', '>f', '>f', '>i']))
+
+# processes exposed as PROC_SPC variables; SPC is the species label
+_PRCS_24 = tuple(k for k in _IPR_DTYPE_24.names if k != 'SPC')
+_PRCS_26 = tuple(k for k in _IPR_DTYPE_26.names if k != 'SPC')
+
+# record field names for constant time membership tests in __variables
+_FIELDS_24 = frozenset(_PRCS_24)
+_FIELDS_26 = frozenset(_PRCS_26)
+
+# record id fields; identical for every species of a cell and time
+_ID_FIELDS = frozenset(['SPAD', 'DATE', 'TIME', 'PAGRID', 'NEST', 'I', 'J',
+                        'K', 'EPAD'])
+
+
+class _LazyVarKeys(object):
+    """
+    List-like sequence of PROC_SPC variable names that are only built
+    the first time they are iterated; membership is tested without
+    building the names.
+    """
+
+    def __init__(self, prcs, spcs, extras):
+        self._prcs = list(prcs)
+        self._spcs = list(spcs)
+        self._prcset = frozenset(self._prcs)
+        self._spcset = frozenset(self._spcs)
+        self._extras = list(extras)
+        self._names = None
+
+    def _list(self):
+        if self._names is None:
+            self._names = [prc + '_' + spc
+                           for prc in self._prcs for spc in self._spcs]
+        return self._names + self._extras
+
+    def __iter__(self):
+        return iter(self._list())
+
+    def __len__(self):
+        return len(self._prcs) * len(self._spcs) + len(self._extras)
+
+    def __contains__(self, k):
+        if not isinstance(k, str):
+            return False
+        if k in self._extras:
+            return True
+        prc, sep, spc = k.partition('_')
+        return sep == '_' and prc in self._prcset and spc in self._spcset
+
+    def __add__(self, other):
+        return self._list() + list(other)
+
+    def append(self, k):
+        self._extras.append(k)
 
 
 class ipr(PseudoNetCDFFile):
@@ -75,59 +146,36 @@ class ipr(PseudoNetCDFFile):
     dt_fmt = "if"
     data_fmt = "f"
 
-    def __init__(self, rf, multi=False, **props):
+    def __init__(self, rf, multi=False, fieldcache=0, **props):
         """
         Initialization included reading the header and learning
         about the format.
 
         see __readheader and __gettimestep() for more info
 
+        fieldcache - number of process fields to keep as native-endian,
+                     contiguous copies of all species; the least recently
+                     used field is dropped when more are requested.  By
+                     default (0) variables are views of the memory map
+
         Keywords (i.e., props) for projection: P_ALP, P_BET, P_GAM, XCENT,
                                             YCENT, XORIG, YORIG, XCELL, YCELL
         """
+        if fieldcache < 0:
+            raise ValueError("fieldcache must be >= 0; got %r" % fieldcache)
         self.__rffile = OpenRecordFile(rf)
         self.__readheader()
-        self.__ipr_record_type = {
-            24: dtype(
-                dict(
-                    names=['SPAD', 'DATE', 'TIME', 'SPC', 'PAGRID', 'NEST',
-                           'I', 'J', 'K', 'INIT', 'CHEM', 'EMIS', 'PTEMIS',
-                           'PIG', 'WADV', 'EADV', 'SADV', 'NADV', 'BADV',
-                           'TADV', 'DIL', 'WDIF', 'EDIF', 'SDIF', 'NDIF',
-                           'BDIF', 'TDIF', 'DDEP', 'WDEP', 'AERCHEM', 'FCONC',
-                           'UCNV', 'AVOL', 'EPAD'],
-                    formats=['>i', '>i', '>f', '>S10', '>i', '>i', '>i', '>i',
-                             '>i', '>f', '>f', '>f', '>f', '>f', '>f', '>f',
-                             '>f', '>f', '>f', '>f', '>f', '>f', '>f', '>f',
-                             '>f', '>f', '>f', '>f', '>f', '>f', '>f', '>f',
-                             '>f', '>i'])),
-            26: dtype(
-                dict(
-                    names=['SPAD', 'DATE', 'TIME', 'SPC', 'PAGRID', 'NEST',
-                           'I', 'J', 'K', 'INIT', 'CHEM', 'EMIS', 'PTEMIS',
-                           'PIG', 'WADV', 'EADV', 'SADV', 'NADV', 'BADV',
-                           'TADV', 'DIL', 'WDIF', 'EDIF', 'SDIF', 'NDIF',
-                           'BDIF', 'TDIF', 'DDEP', 'WDEP', 'INORGACHEM',
-                           'ORGACHEM', 'AQACHEM', 'FCONC', 'UCNV', 'AVOL',
-                           'EPAD'],
-                    formats=['>i', '>i', '>f', '>S10', '>i', '>i', '>i', '>i',
-                             '>i', '>f', '>f', '>f', '>f', '>f', '>f', '>f',
-                             '>f', '>f', '>f', '>f', '>f', '>f', '>f', '>f',
-                             '>f', '>f', '>f', '>f', '>f', '>f', '>f', '>f',
-                             '>f', '>f', '>f', '>i']))
-        }[len(self.prcnames)]
-
-        aeroprocs = {24: ['AERCHEM'],
-                     26: ['INORGACHEM', 'ORGACHEM',
-                          'AQACHEM']}[len(self.prcnames)]
-        prcs = (['SPAD', 'DATE', 'TIME', 'PAGRID', 'NEST', 'I', 'J', 'K',
-                 'INIT', 'CHEM', 'EMIS', 'PTEMIS', 'PIG', 'WADV', 'EADV',
-                 'SADV', 'NADV', 'BADV', 'TADV', 'DIL', 'WDIF', 'EDIF', 'SDIF',
-                 'NDIF', 'BDIF', 'TDIF', 'DDEP', 'WDEP'] +
-                aeroprocs + ['FCONC', 'UCNV', 'AVOL', 'EPAD'])
-        varkeys = ['_'.join(i) for i in cartesian(prcs, self.spcnames)]
-        varkeys += ['SPAD', 'DATE', 'TIME',
-                    'PAGRID', 'NEST', 'I', 'J', 'K', 'TFLAG']
+        nprc = len(self.prcnames)
+        self.__ipr_record_type = {24: _IPR_DTYPE_24,
+                                  26: _IPR_DTYPE_26}[nprc]
+        prcs = {24: _PRCS_24, 26: _PRCS_26}[nprc]
+        self.__fieldset = {24: _FIELDS_24, 26: _FIELDS_26}[nprc]
+        self.__spcindex = {}
+        for si, spc in enumerate(self.spcnames):
+            self.__spcindex.setdefault(spc, si)
+        varkeys = _LazyVarKeys(prcs, self.spcnames,
+                               ['SPAD', 'DATE', 'TIME', 'PAGRID', 'NEST',
+                                'I', 'J', 'K', 'TFLAG'])
         self.groups = {}
         NSTEPS = len([i_ for i_ in self.timerange()])
         NVARS = len(varkeys)
@@ -135,15 +183,12 @@ class ipr(PseudoNetCDFFile):
         self.createDimension('DATE-TIME', 2)
         self.createDimension('TSTEP', NSTEPS)
         padatatype = []
-        pavarkeys = []
         for di, domain in enumerate(self.padomains):
             dk = 'PA%02d' % di
-            prefix = dk + '_'
             if len(self.padomains) == 1:
                 grp = self.groups[dk] = self
             else:
                 grp = self.groups[dk] = PseudoNetCDFFile()
-            pavarkeys.extend([prefix + k for k in varkeys])
             grp.createDimension('VAR', NVARS)
             grp.createDimension('DATE-TIME', 2)
             grp.createDimension('TSTEP', NSTEPS)
@@ -165,6 +210,9 @@ class ipr(PseudoNetCDFFile):
         self.__memmaps = memmap(self.__rffile.infile.name, dtype(padatatype),
                                 'r',
                                 self.data_start_byte).reshape(NSTEPS, nspc)
+        advise_sequential(self.__memmaps)
+        self.__fields = OrderedDict()
+        self.__fieldcache = fieldcache
         for k, v in props.items():
             setattr(self, k, v)
         try:
@@ -174,6 +222,7 @@ class ipr(PseudoNetCDFFile):
 
     def __del__(self):
         try:
+            self.__fields.clear()
             del self.__memmaps
         except Exception:
             pass
@@ -196,33 +245,74 @@ class ipr(PseudoNetCDFFile):
             setattr(pncfv, k, v)
         return pncfv
 
+    def __field(self, pk, proc):
+        """
+        Return record field proc of domain pk as a native-endian,
+        contiguous (TSTEP, SPC, LAY, ROW, COL) array. The memmap is
+        strided through once per field and the result is reused for
+        every species of that process while it stays among the
+        fieldcache most recently used fields. Record id fields repeat
+        the same values for every species, so only the first species
+        is kept.
+        """
+        fieldkey = (pk, proc)
+        if fieldkey in self.__fields:
+            # move to the most recently used end
+            self.__fields[fieldkey] = self.__fields.pop(fieldkey)
+        else:
+            # file order is (TSTEP, SPC, ROW, COL, LAY); each time slab
+            # is gathered in file order and then reordered in memory so
+            # the file is walked once, front to back
+            mm = self.__memmaps[pk]
+            nt, nspc, nrow, ncol, nlay = mm.shape
+            if proc in _ID_FIELDS:
+                nspc = 1
+            ndtype = mm.dtype[proc].newbyteorder('=')
+            vals = empty((nt, nspc, nlay, nrow, ncol), dtype=ndtype)
+            for ti in range(nt):
+                slab = ascontiguousarray(mm[ti, :nspc][proc], dtype=ndtype)
+                vals[ti] = slab.transpose(0, 3, 1, 2)
+            vals.flags.writeable = False
+            self.__fields[fieldkey] = vals
+            while len(self.__fields) > self.__fieldcache:
+                self.__fields.popitem(last=False)
+        return self.__fields[fieldkey]
+
+    def __values(self, pk, proc, si):
+        """
+        Return the (TSTEP, LAY, ROW, COL) values of field proc for
+        species index si of domain pk; a memmap view unless the
+        field cache is enabled
+        """
+        if proc in _ID_FIELDS:
+            si = 0
+        if self.__fieldcache:
+            return self.__field(pk, proc)[:, si]
+        # file order is (TSTEP, SPC, ROW, COL, LAY)
+        return self.__memmaps[pk][:, si][proc].transpose(0, 3, 1, 2)
+
     def __variables(self, pk, proc_spc):
-        if proc_spc in self.__ipr_record_type.names:
+        fieldset = self.__fieldset
+        if proc_spc in fieldset:
             proc = proc_spc
             proc_spc = proc_spc + '_' + self.spcnames[0]
-            tmpvals = self.__memmaps[pk][:, 0, :, :, :][proc]
-            tmpvals = tmpvals.swapaxes(1, 3).swapaxes(2, 3)
+            tmpvals = self.__values(pk, proc, 0)
             return PseudoNetCDFVariable(self, proc_spc, 'f',
                                         ('TSTEP', 'LAY', 'ROW', 'COL'),
                                         values=tmpvals)
         if proc_spc == 'TFLAG':
-            thisdate = self.__memmaps[pk][:, 0, :, :, :]['DATE'].swapaxes(
-                1, 3).swapaxes(2, 3)[..., 0, 0, 0]
-            thistime = self.__memmaps[pk][:, 0, :, :, :]['TIME'].swapaxes(
-                1, 3).swapaxes(2, 3)[..., 0, 0, 0]
+            thisdate = self.__memmaps[pk][:, 0, 0, 0, 0]['DATE']
+            thistime = self.__memmaps[pk][:, 0, 0, 0, 0]['TIME']
             nvar = len(self.groups[pk].dimensions['VAR'])
             return ConvertCAMxTime(thisdate, thistime, nvar)
-        for k in self.__ipr_record_type.names:
-            proc = proc_spc[:len(k)]
-            spc = proc_spc[len(k) + 1:]
-            if proc == k and spc in self.spcnames:
-                spc = self.spcnames.index(spc)
-                dvals = self.__memmaps[pk][:, spc][proc].swapaxes(
-                    1, 3).swapaxes(2, 3)
-                tmpvar = PseudoNetCDFVariable(self, proc_spc, 'f',
-                                              ('TSTEP', 'LAY', 'ROW', 'COL'),
-                                              values=dvals)
-                return self.__decorator(proc_spc, tmpvar)
+        proc, sep, spc = proc_spc.partition('_')
+        if proc in fieldset and spc in self.__spcindex:
+            spc = self.__spcindex[spc]
+            dvals = self.__values(pk, proc, spc)
+            tmpvar = PseudoNetCDFVariable(self, proc_spc, 'f',
+                                          ('TSTEP', 'LAY', 'ROW', 'COL'),
+                                          values=dvals)
+            return self.__decorator(proc_spc, tmpvar)
         raise KeyError("Bad!")
 
     def __readheader(self):
@@ -249,8 +339,7 @@ class ipr(PseudoNetCDFFile):
 
         self.spcnames = []
         for spc in range(self.__rffile.read("i")[-1]):
-            self.spcnames.append(char.decode(
-                self.__rffile.read("10s")[-1]).strip())
+            self.spcnames.append(self.__rffile.read("10s")[-1].strip())
 
         self.nspec = len(self.spcnames)
         self.padomains = []
@@ -293,15 +382,82 @@ class ipr(PseudoNetCDFFile):
         return timerange(t1, t2, self.time_step)
 
 
+def _writetestipr(path, spcs, prcs):
+    """
+    Writes a small 2 time, 2 layer, 3 row, 4 column ipr file for tests
+    whose values count up in file order; returns the values as
+    (TSTEP, SPC, ROW, COL, LAY, PROC)
+    """
+    from numpy import arange
+    from PseudoNetCDF.camxfiles.FortranFileUtil import writeline
+    nt, nj, ni, nk = 2, 3, 4, 2
+    vals = arange(nt * len(spcs) * nj * ni * nk * len(prcs),
+                  dtype='f').reshape(nt, len(spcs), nj, ni, nk, len(prcs))
+    out = [writeline([b'ipr test'], '80s'),
+           writeline([5185, 0., 5185, nt * 100.], 'ifif'),
+           writeline([1], 'i'), writeline([0, 0, ni, nj, 1, 1], '6i'),
+           writeline([len(spcs)], 'i')]
+    out += [writeline([s.ljust(10).encode()], '10s') for s in spcs]
+    out += [writeline([1], 'i'), writeline([1, 1, ni, 1, nj, 1, nk], '7i'),
+            writeline([len(prcs)], 'i')]
+    out += [writeline([p.ljust(25).encode()], '25s') for p in prcs]
+    data_fmt = 'if10s5i%df' % len(prcs)
+    for t in range(nt):
+        for si, spc in enumerate(spcs):
+            for j in range(nj):
+                for i in range(ni):
+                    for k in range(nk):
+                        out.append(writeline(
+                            [5185, (t + 1) * 100., spc.ljust(10).encode(),
+                             1, 0, i + 1, j + 1, k + 1] +
+                            vals[t, si, j, i, k].tolist(), data_fmt))
+    with open(path, 'wb') as outf:
+        outf.write(b''.join(out))
+    return vals
+
+
 class TestMemmap(unittest.TestCase):
     def runTest(self):
         pass
 
     def setUp(self):
-        pass
+        from tempfile import mkdtemp
+        self.tmpdir = mkdtemp()
+        self.spcs = ['O3', 'NO2']
+
+    def tearDown(self):
+        from shutil import rmtree
+        rmtree(self.tmpdir)
 
     def testIPR(self):
-        warn('Test not implemented; data too big for distribution')
+        import os
+        for allprcs in (_PRCS_24, _PRCS_26):
+            prcs = [p for p in allprcs if p not in _ID_FIELDS]
+            path = os.path.join(self.tmpdir, 'test%d.ipr' % len(prcs))
+            vals = _writetestipr(path, self.spcs, prcs)
+            iprfile = ipr(path)
+            cached = ipr(path, fieldcache=1)
+            tflag = iprfile.variables['TFLAG']
+            self.assertEqual(tflag.dimensions, ('TSTEP', 'VAR', 'DATE-TIME'))
+            self.assertEqual(tflag[:, 0].tolist(),
+                             [[2005185, 10000], [2005185, 20000]])
+            for prc in ('INIT', 'CHEM', prcs[-1]):
+                for si, spc in enumerate(self.spcs):
+                    key = prc + '_' + spc
+                    check = vals[:, si, ..., prcs.index(prc)]
+                    check = check.transpose(0, 3, 1, 2)
+                    var = iprfile.variables[key]
+                    self.assertEqual(var.dimensions,
+                                     ('TSTEP', 'LAY', 'ROW', 'COL'))
+                    self.assertEqual(var.shape, (2, 2, 3, 4))
+                    self.assertTrue((var[:] == check).all())
+                    self.assertTrue((cached.variables[key][:] == check).all())
+            self.assertEqual(iprfile.variables['K'][0, :, 0, 0].tolist(),
+                             [1, 2])
+            self.assertIn('CHEM_O3', iprfile.variables)
+            self.assertNotIn('SPC_O3', iprfile.variables)
+            self.assertNotIn(1, iprfile.variables)
+            self.assertRaises(ValueError, ipr, path, fieldcache=-1)
 
 
 if __name__ == '__main__':
@@ -13,7 +13,6 @@ __doc__ = """
 """
 # Distribution packages
 import unittest
-import struct
 from warnings import warn
 
 # Site-Packages
@@ -30,12 +29,6 @@ from PseudoNetCDF.sci_var import PseudoNetCDFVariable as pncvar
 from PseudoNetCDF.sci_var import PseudoNetCDFVariables
 from PseudoNetCDF.ArrayTransforms import ConvertCAMxTime
 
-# for use in identifying uncaught nan
-listnan = struct.unpack('>f', b'\xff\xc0\x00\x00')[0]
-checkarray = zeros((1,), 'f')
-checkarray[0] = listnan
-array_nan = checkarray[0]
-
 
 class ipr(PseudoNetCDFFile):
     """
@@ -146,10 +139,9 @@ class ipr(PseudoNetCDFFile):
 
     def __variables(self, proc_spc):
         if proc_spc == 'TFLAG':
-            time = self.variables['TIME_%s' %
-                                  char.decode(self.spcnames)[0][1].strip()]
-            date = self.variables['DATE_%s' %
-                                  char.decode(self.spcnames[0])[1].strip()]
+            spc = self.spcnames['SPECIES'][0].decode().strip()
+            time = self.variables['TIME_%s' % spc]
+            date = self.variables['DATE_%s' % spc]
             tmpvals = ConvertCAMxTime(date[:, 0, 0, 0],
                                       time[:, 0, 0, 0],
                                       len(self.dimensions['VAR']))
@@ -187,28 +179,27 @@ class ipr(PseudoNetCDFFile):
                 return self.variables[proc_spc]
         raise KeyError("Bad!")
 
-    def __readonetime(self, ntime, spc):
-        newpos = self.__start(ntime, spc)
-        oldpos = self.__rffile.tell()
-        relmove = newpos - oldpos
-        self.__rffile.seek(relmove, 1)
-        tmpout = fromfile(self.__rffile, dtype=self.__ipr_record_type,
-                          count=self.__block3d)
-
-        return tmpout.reshape(self.NROWS, self.NCOLS, self.NLAYS)\
-                     .swapaxes(0, 2)\
-                     .swapaxes(1, 2)
+    def __readonetime(self, ntime, nspec, out):
+        """
+        Read the (ROW, COL, LAY) slab of species index nspec at time
+        index ntime directly into the contiguous record array out
+        """
+        self.__rffile.seek(self.__start(ntime, nspec), 0)
+        nbytes = self.__rffile.readinto(out)
+        if nbytes != out.nbytes:
+            raise EOFError('Read %d of %d bytes for time %d, species %d' %
+                           (nbytes, out.nbytes, ntime, nspec))
 
     def __readalltime(self, spc):
-        out = zeros((self.NSTEPS, self.NLAYS, self.NROWS,
-                     self.NCOLS), dtype=self.__ipr_record_type)
-        for it in range(self.NSTEPS):
-            out[it] = self.__readonetime(it, spc)
-        return out
-
-    def __start(self, ntime, spc):
         nspec = char.decode(
             self.spcnames['SPECIES']).tolist().index(spc.ljust(10))
+        out = zeros((self.NSTEPS, self.NROWS, self.NCOLS,
+                     self.NLAYS), dtype=self.__ipr_record_type)
+        for it in range(self.NSTEPS):
+            self.__readonetime(it, nspec, out[it])
+        return out.transpose(0, 3, 1, 2)
+
+    def __start(self, ntime, nspec):
         return (self.__data_start_byte +
                 (int(ntime) * self.__block4d + self.__block3d * nspec) *
                 self.__ipr_record_type.itemsize)
@@ -234,7 +225,7 @@ class ipr(PseudoNetCDFFile):
         self.__grids = []
         self.NGRIDS = fromfile(self.__rffile, dtype=dtype(
             dict(names=['SPAD', 'NGRIDS', 'EPAD'],
-                 formats=['>i'] * 3)), count=1)['NGRIDS']
+                 formats=['>i'] * 3)), count=1)['NGRIDS'][0]
         for grid in range(self.NGRIDS):
             gddt = dtype(dict(names=['SPAD', 'orgx', 'orgy', 'ncol', 'nrow',
                                      'xsize', 'ysize', 'EPAD'],
@@ -317,7 +308,7 @@ class ipr(PseudoNetCDFFile):
         prdt = dtype(dict(names=['SPAD', 'PROCESS', 'EPAD'],
                           formats=['>i', '>25S', '>i']))
         self.prcnames = fromfile(self.__rffile, dtype=prdt,
-                                 count=self.NPROCESS)
+                                 count=self.NPROCESS[0])
         self.__data_start_byte = self.__rffile.tell()
 
     def __setDomain__(self, id=0):
@@ -341,13 +332,13 @@ class ipr(PseudoNetCDFFile):
         and second date/time and initializes variables indicating the
         timestep length and the anticipated number.
         """
-        self.__rffile.seek(self.__data_start_byte, 0)
-        rcount = (len(self.dimensions['LAY']) *
-                  len(self.dimensions['ROW']) *
-                  len(self.dimensions['COL']) + 1)
+        # only the first record after the first 3D block is needed
+        self.__rffile.seek(self.__data_start_byte +
+                           self.__block3d * self.__ipr_record_type.itemsize,
+                           0)
         temp = fromfile(self.__rffile,
                         dtype=self.__ipr_record_type,
-                        count=rcount)
+                        count=1)
         self.TSTEP = timediff((self.SDATE, self.STIME),
                               (temp[-1]['DATE'] + 2000000, temp[-1]['TIME']))
         self.NSTEPS = int(timediff((self.SDATE, self.STIME),
@@ -359,10 +350,57 @@ class TestRead(unittest.TestCase):
         pass
 
     def setUp(self):
-        pass
+        from tempfile import mkdtemp
+        self.tmpdir = mkdtemp()
+        self.spcs = ['O3', 'NO2']
+
+    def tearDown(self):
+        from shutil import rmtree
+        rmtree(self.tmpdir)
 
     def testIPR(self):
-        warn('Test not implemented; data too big for distribution')
+        import os
+        from warnings import catch_warnings, simplefilter
+        from PseudoNetCDF.camxfiles.ipr.Memmap import _writetestipr
+        from PseudoNetCDF.camxfiles.ipr.Memmap import _PRCS_24, _PRCS_26
+        from PseudoNetCDF.camxfiles.ipr.Memmap import _ID_FIELDS
+        for allprcs in (_PRCS_24, _PRCS_26):
+            prcs = [p for p in allprcs if p not in _ID_FIELDS]
+            path = os.path.join(self.tmpdir, 'test%d.ipr' % len(prcs))
+            vals = _writetestipr(path, self.spcs, prcs)
+            with catch_warnings():
+                # small files warn that ipr_memmap is faster
+                simplefilter('ignore')
+                iprfile = ipr(path)
+            self.assertEqual(iprfile.NSTEPS, 2)
+            tflag = iprfile.variables['TFLAG']
+            self.assertEqual(tflag.dimensions, ('TSTEP', 'VAR', 'DATE-TIME'))
+            self.assertEqual(tflag[:, 0].tolist(),
+                             [[2005185, 10000], [2005185, 20000]])
+            for prc in ('INIT', 'CHEM', prcs[-1]):
+                for si, spc in enumerate(self.spcs):
+                    check = vals[:, si, ..., prcs.index(prc)]
+                    check = check.transpose(0, 3, 1, 2)
+                    var = iprfile.variables[prc + '_' + spc]
+                    self.assertEqual(var.dimensions,
+                                     ('TSTEP', 'LAY', 'ROW', 'COL'))
+                    self.assertEqual(var.shape, (2, 2, 3, 4))
+                    self.assertTrue((var[:] == check).all())
+
+    def testIPRTruncated(self):
+        import os
+        from warnings import catch_warnings, simplefilter
+        from PseudoNetCDF.camxfiles.ipr.Memmap import _writetestipr
+        from PseudoNetCDF.camxfiles.ipr.Memmap import _PRCS_24, _ID_FIELDS
+        prcs = [p for p in _PRCS_24 if p not in _ID_FIELDS]
+        path = os.path.join(self.tmpdir, 'short.ipr')
+        _writetestipr(path, self.spcs, prcs)
+        with open(path, 'r+b') as outf:
+            outf.truncate(os.path.getsize(path) - 200)
+        with catch_warnings():
+            simplefilter('ignore')
+            iprfile = ipr(path)
+        self.assertRaises(EOFError, lambda: iprfile.variables['CHEM_NO2'])
 
 
 if __name__ == '__main__':
@@ -14,27 +14,20 @@ __doc__ = """
 
 # Distribution packages
 import unittest
-import struct
-from warnings import warn
 from collections import defaultdict
 from functools import partial
 
 # Site-Packages
-from numpy import zeros, memmap, dtype
+from numpy import memmap, dtype
 
 # This Package modules
 from PseudoNetCDF.camxfiles.timetuple import timeadd, timerange
 from PseudoNetCDF.camxfiles.FortranFileUtil import OpenRecordFile
+from PseudoNetCDF.camxfiles.util import advise_sequential
 from PseudoNetCDF.sci_var import PseudoNetCDFFile, PseudoNetCDFVariable
 from PseudoNetCDF.sci_var import PseudoNetCDFVariables
 from PseudoNetCDF.ArrayTransforms import ConvertCAMxTime
 
-# for use in identifying uncaught nan
-listnan = struct.unpack('>f', b'\xff\xc0\x00\x00')[0]
-checkarray = zeros((1,), 'f')
-checkarray[0] = listnan
-array_nan = checkarray[0]
-
 
 def _isMine(path):
     testf = OpenRecordFile(path)
@@ -141,6 +134,7 @@ class irr(PseudoNetCDFFile):
                 grp.variables = PseudoNetCDFVariables(varget, varkeys)
         self.__memmaps = memmap(self.__rffile.infile.name, dtype(
             padatatype), 'r', self.data_start_byte)
+        advise_sequential(self.__memmaps)
 
     def __del__(self):
         try:
@@ -162,7 +156,7 @@ class irr(PseudoNetCDFFile):
             return ConvertCAMxTime(self.__memmaps[pk][:, 0, 0, 0]['DATE'],
                                    self.__memmaps[pk][:, 0, 0, 0]['TIME'],
                                    len(self.groups[pk].dimensions['VAR']))
-        tmpvals = self.__memmaps[pk][rxn].swapaxes(1, 3).swapaxes(2, 3)
+        tmpvals = self.__memmaps[pk][rxn].transpose(0, 3, 1, 2)
         return self.__decorator(rxn,
                                 pncvar(self, rxn, 'f',
                                        ('TSTEP', 'LAY', 'ROW', 'COL'),
@@ -227,10 +221,48 @@ class TestMemmap(unittest.TestCase):
         pass
 
     def setUp(self):
-        pass
+        from tempfile import mkdtemp
+        self.tmpdir = mkdtemp()
+
+    def tearDown(self):
+        from shutil import rmtree
+        rmtree(self.tmpdir)
 
     def testIRR(self):
-        warn('Test not implemented; data too big for distribution')
+        import os
+        from numpy import arange
+        from PseudoNetCDF.camxfiles.FortranFileUtil import writeline
+        nt, nj, ni, nk, nrxn = 2, 3, 4, 2, 5
+        vals = arange(nt * nj * ni * nk * nrxn,
+                      dtype='f').reshape(nt, nj, ni, nk, nrxn)
+        out = [writeline([b'irr test'], '80s'),
+               writeline([5185, 0., 5185, nt * 100.], 'ifif'),
+               writeline([1], 'i'),
+               writeline([0, 0, ni, nj, 1, 1, 0], '7i'),
+               writeline([1], 'i'),
+               writeline([1, 1, ni, 1, nj, 1, nk], '7i'),
+               writeline([nrxn], 'i')]
+        data_fmt = 'if5i%df' % nrxn
+        for t in range(nt):
+            for j in range(nj):
+                for i in range(ni):
+                    for k in range(nk):
+                        out.append(writeline(
+                            [5185, (t + 1) * 100., 1, 0, i + 1, j + 1,
+                             k + 1] + vals[t, j, i, k].tolist(), data_fmt))
+        path = os.path.join(self.tmpdir, 'test.irr')
+        with open(path, 'wb') as outf:
+            outf.write(b''.join(out))
+        irrfile = irr(path)
+        tflag = irrfile.variables['TFLAG']
+        self.assertEqual(tflag[:, 0].tolist(),
+                         [[2005185, 10000], [2005185, 20000]])
+        check = vals.transpose(4, 0, 3, 1, 2)
+        for ri in range(nrxn):
+            var = irrfile.variables['RXN_%02d' % (ri + 1)]
+            self.assertEqual(var.dimensions, ('TSTEP', 'LAY', 'ROW', 'COL'))
+            self.assertEqual(var.shape, (nt, nk, nj, ni))
+            self.assertTrue((var[:] == check[ri]).all())
 
 
 if __name__ == '__main__':
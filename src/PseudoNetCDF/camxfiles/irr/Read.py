@@ -15,24 +15,19 @@ __doc__ = """
 # Distribution packages
 from datetime import datetime
 import unittest
-import struct
 from warnings import warn
 from math import ceil
 
 # Site-Packages
-from numpy import zeros, array, dtype, fromfile, arange
+from numpy import dtype, fromfile, arange, memmap
+from numpy import ascontiguousarray, column_stack, datetime64, timedelta64
 
 # This Package modules
 from PseudoNetCDF.sci_var import PseudoNetCDFFile, PseudoNetCDFVariable
 from PseudoNetCDF.sci_var import PseudoNetCDFVariables
+from PseudoNetCDF.camxfiles.util import advise_sequential
 pncvar = PseudoNetCDFVariable
 
-# for use in identifying uncaught nan
-listnan = struct.unpack('>f', b'\xff\xc0\x00\x00')[0]
-checkarray = zeros((1,), 'f')
-checkarray[0] = listnan
-array_nan = checkarray[0]
-
 
 class irr(PseudoNetCDFFile):
     """
@@ -64,14 +59,20 @@ class irr(PseudoNetCDFFile):
     id_fmt = "ifiiiii"
     data_fmt = "f"
 
-    def __init__(self, rf, units='ppm/hr', conva=None, nvarcache=None):
+    def __init__(self, rf, units='ppm/hr', conva=None, nvarcache=None,
+                 validate=False):
         """
         Initialization included reading the header and learning
         about the format.
 
         see __readheader and __gettimestep() for more info
+
+        validate - if True, loadVars checks the date, time and cell
+                   indices of every record it reads and raises
+                   ValueError on a mismatch
         """
-        rffile = self._rffile = open(rf)
+        self._validate = validate
+        rffile = self._rffile = open(rf, 'rb')
         rffile.seek(0, 2)
         if rffile.tell() < 2147483648:
             warn("For greater speed on files <2GB use ipr_memmap")
@@ -101,8 +102,8 @@ class irr(PseudoNetCDFFile):
             'TFLAG', 'i', ('TSTEP', 'VAR', 'DATE-TIME'))
         tflag.units = '<YYYYJJJ, HHMMSS>'
         tflag.var_desc = tflag.long_name = 'TFLAG'.ljust(16)
-        tflag[:] = array(self.timerange(), dtype='i').reshape(
-            self.NSTEPS, 1, 2)
+        tflag[:] = column_stack([self._yyjjj, self._hhmm]).astype('i')[
+            :, None, :]
 
     def __var_get(self, key):
         rxni = int(key.split('_')[1])
@@ -111,8 +112,8 @@ class irr(PseudoNetCDFFile):
             'TFLAG', 'i', ('TSTEP', 'VAR', 'DATE-TIME'))
         tflag.units = '<YYYYJJJ, HHMMSS>'
         tflag.var_desc = tflag.long_name = 'TFLAG'.ljust(16)
-        tflag[:] = array(self.timerange(), dtype='i').reshape(
-            self.NSTEPS, 1, 2)
+        tflag[:] = column_stack([self._yyjjj, self._hhmm]).astype('i')[
+            :, None, :]
         return self.variables[key]
 
     def __readheader(self):
@@ -173,6 +174,14 @@ class irr(PseudoNetCDFFile):
                                     ('EPAD', '>i')])
         self._padded_size = self._record_dtype.itemsize
 
+        # records spanned by one time step, row, column and layer
+        self._strides = []
+        for domain in self.padomains:
+            nk = domain['tlay'] - domain['blay'] + 1
+            ni = domain['iend'] - domain['istart'] + 1
+            nj = domain['jend'] - domain['jstart'] + 1
+            self._strides.append((nj * ni * nk, ni * nk, nk, 1))
+
     def __gettimestep(self):
         """
         Header information provides start and end date, but does not
@@ -181,10 +190,10 @@ class irr(PseudoNetCDFFile):
         timestep length and the anticipated number.
         """
         self._activedomain = self.padomains[0]
+        nj = self._activedomain['jend'] - self._activedomain['jstart'] + 1
         self._rffile.seek(
             self._data_start_byte + (
-                self.__jrecords(0, self.padomains[0]['jend']) *
-                self._padded_size
+                (nj - 1) * self._strides[0][1] * self._padded_size
             ), 0
         )
         date, time = fromfile(self._rffile, dtype=self._record_dtype, count=1)[
@@ -202,15 +211,17 @@ class irr(PseudoNetCDFFile):
             (tstep.days * 24 * 3600. + tstep.seconds)
         self.NSTEPS = self.time_step_count = int(multiple)
         assert(multiple == int(multiple))
+        self._yyjjj, self._hhmm = self.__timearrays()
+        self._timerange = list(zip(self._yyjjj.tolist(), self._hhmm.tolist()))
+        self._time_index = dict((dt, i) for i, dt in
+                                enumerate(self._timerange))
 
     def __gridrecords(self, pagrid):
         """
         routine returns the number of records to increment from the
         data start byte to find the pagrid
         """
-        ntime = self.__timerecords(
-            pagrid, (self.EDATE, int(self.ETIME + self.TSTEP)))
-        return ntime
+        return self.NSTEPS * self._strides[pagrid][0]
 
     def __timerecords(self, pagrid, dt):
         """
@@ -218,39 +229,13 @@ class irr(PseudoNetCDFFile):
         data start byte to find the first time
         """
         d, t = dt
-        nsteps = self.timerange().index((d, t))
-        nj = self.__jrecords(pagrid, self.padomains[pagrid]['jend'] + 1)
-        return nsteps * nj
-
-    def __irecords(self, pagrid, i):
-        """
-        routine returns the number of records to increment from the
-        data start byte to find the first icell
-        """
-        ni = i - self._activedomain['istart']
-        nk = self.__krecords(pagrid, self._activedomain['tlay'] + 1)
-        return ni * nk
-
-    def __jrecords(self, pagrid, j):
-        """
-        routine returns the number of records to increment from the
-        data start byte to find the first jcell
-        """
-        nj = j - self._activedomain['jstart']
-        ni = self.__irecords(pagrid, self._activedomain['iend'] + 1)
-        return nj * ni
-
-    def __krecords(self, pagrid, k):
-        """
-        routine returns the number of records to increment from the
-        data start byte to find the first kcell
-        """
-        return k - self._activedomain['blay']
+        nsteps = self._time_index[(d, t)]
+        return nsteps * self._strides[pagrid][0]
 
     def __recordposition(self, pagrid, date, time, i, j, k):
         """
-        routine uses pagridrecords, timerecords,irecords,
-        jrecords, and krecords multiplied by the fortran padded size
+        routine uses pagridrecords, timerecords and the row, column
+        and layer record strides multiplied by the fortran padded size
         to return the byte position of the specified record
 
         pagrid - integer
@@ -260,13 +245,15 @@ class irr(PseudoNetCDFFile):
         j - integer
         k - integer
         """
+        domain = self.padomains[pagrid]
+        jstride, istride, kstride = self._strides[pagrid][1:]
         records = 0
         for pag in range(pagrid):
             records += self.__gridrecords(pag)
         records += self.__timerecords(pagrid, (date, time))
-        records += self.__jrecords(pagrid, j)
-        records += self.__irecords(pagrid, i)
-        records += self.__krecords(pagrid, k)
+        records += ((j - domain['jstart']) * jstride +
+                    (i - domain['istart']) * istride +
+                    (k - domain['blay']) * kstride)
         return records * self._padded_size + self._data_start_byte
 
     def _seek(self, pagrid=1, date=None, time=None, i=1, j=1, k=1):
@@ -282,6 +269,15 @@ class irr(PseudoNetCDFFile):
         self._rffile.seek(self.__recordposition(pagrid, date, time, i, j, k))
 
     def loadVars(self, start, n, pagrid=0):
+        """
+        Load reactions start through start + n - 1 into variables
+
+        pagrid - must be 0; the file dimensions describe only the first
+                 PA domain, so other domains cannot be labelled
+        """
+        if pagrid != 0:
+            raise ValueError("irr only supports PA domain 0; got %r" %
+                             (pagrid,))
         domain = self.padomains[pagrid]
         istart = domain['istart']
         iend = domain['iend']
@@ -293,50 +289,66 @@ class irr(PseudoNetCDFFile):
         nk = kend + 1 - kstart
         nj = jend + 1 - jstart
         ni = iend + 1 - istart
-        nrec = nk * ni * nj
-        temp = zeros((nrec, self.NRXNS), 'f')
-        shape = (self.NSTEPS,) + \
-            tuple(eval('map(len, (LAY, ROW, COL))', None, self.dimensions))
         variables.clear()
         end = min(start + n, self.NRXNS + 1)
         start = max(1, end - n)
-        for rxn in range(start, end):
+
+        # Each domain is a fixed stride record stream ordered
+        # (TSTEP, ROW, COL, LAY), so all times are mapped at once
+        date, time = self._timerange[0]
+        offset = self.__recordposition(pagrid, date, time,
+                                       istart, jstart, kstart)
+        records = memmap(self._rffile.name, dtype=self._record_dtype,
+                         mode='r', offset=offset,
+                         shape=(self.NSTEPS, nj, ni, nk))
+        advise_sequential(records)
+        if self._validate:
+            # the id fields are interleaved with the data, so checking
+            # them touches every page of the data section
+            checks = [('I', arange(istart, iend + 1)[None, None, :, None]),
+                      ('J', arange(jstart, jend + 1)[None, :, None, None]),
+                      ('K', arange(kstart, kend + 1)),
+                      ('DATE', self._yyjjj[:, None, None, None]),
+                      ('TIME', self._hhmm[:, None, None, None])]
+            for idkey, expected in checks:
+                if not (records[idkey] == expected).all():
+                    raise ValueError('Unexpected %s in irr records' % idkey)
+        # one native-endian copy of the requested reactions with the
+        # reaction axis first; each irrs[ri] is then contiguous
+        irrs = ascontiguousarray(
+            records['IRRS'][..., start - 1:end - 1].transpose(4, 0, 3, 1, 2),
+            dtype='f')
+        for ri, rxn in enumerate(range(start, end)):
             key = 'RXN_%02d' % rxn
             variables[key] = pncvar(self, key, 'f',
                                     ('TSTEP', 'LAY', 'ROW', 'COL'),
-                                    values=zeros(shape, 'f'), units='ppm/hr',
+                                    values=irrs[ri],
+                                    units='ppm/hr',
                                     var_desk=key.ljust(16),
                                     long_name=key.ljust(16))
+        del records
 
-        self._seek(pagrid=0, i=istart, j=jstart, k=kstart)
-        for ti, (d, t) in enumerate(self.timerange()):
-            record = fromfile(
-                self._rffile, dtype=self._record_dtype, count=nrec)
-            temp[:] = record['IRRS']
-            date = record['DATE']
-            time = record['TIME']
-            id = record['I']
-            jd = record['J']
-            kd = record['K']
-            assert((id == arange(istart, iend + 1)
-                    [None, :, None].repeat(nk, 2).repeat(nj, 0).ravel()).all())
-            assert((kd == arange(kstart, kend + 1)
-                    [None, None, :].repeat(ni, 1).repeat(nj, 0).ravel()).all())
-            assert(((jd == arange(jstart, jend + 1).repeat(ni * nk, 0))).all())
-            assert((date == d).all() and (time == t).all())
-            for rxn in range(start, end):
-                variables['RXN_%02d' % rxn][ti, :, :, :] = \
-                    temp[:, rxn - 1].reshape(nj, ni, nk).swapaxes(1, 2)\
-                                    .swapaxes(0, 1)
-
-    def timerange(self):
+    def __timearrays(self):
+        """
+        Returns the (YYJJJ, HHMM) stamps of every time step as integer
+        and float arrays computed with datetime64 arithmetic
+        """
         tstart = datetime.strptime('%05dT%04d' % (
             self.SDATE, self.STIME), '%y%jT%H%M')
         tdiff = datetime.strptime(
             '%04d' % self.TSTEP, '%H%M') - datetime.strptime('0000', '%H%M')
-        dates = [tstart + (tdiff * i) for i in range(1, self.NSTEPS + 1)]
-        return [(int(d.strftime('%y%j')), float(d.strftime('%H%M')))
-                for d in dates]
+        times = (datetime64(tstart, 's') +
+                 timedelta64(int(tdiff.total_seconds()), 's') *
+                 arange(1, self.NSTEPS + 1))
+        years = times.astype('datetime64[Y]')
+        jday = (times.astype('datetime64[D]') - years).astype('i') + 1
+        yyjjj = (years.astype('i') + 1970) % 100 * 1000 + jday
+        hhmm = (times.astype('datetime64[h]').astype('i8') % 24 * 100 +
+                times.astype('datetime64[m]').astype('i8') % 60)
+        return yyjjj, hhmm.astype('d')
+
+    def timerange(self):
+        return list(self._timerange)
 
 
 class TestRead(unittest.TestCase):
@@ -344,10 +356,90 @@ class TestRead(unittest.TestCase):
         pass
 
     def setUp(self):
-        pass
+        from tempfile import mkdtemp
+        self.tmpdir = mkdtemp()
+
+    def tearDown(self):
+        from shutil import rmtree
+        rmtree(self.tmpdir)
+
+    def _writeirr(self, path, badk=False):
+        """
+        Writes a 2 time, 5 reaction irr file with a 2 layer, 3 row,
+        4 column domain and a 1 layer, 2 row, 2 column subdomain; record
+        values count up in file order.  Returns one (TSTEP, ROW, COL,
+        LAY, RXN) array per domain.
+        """
+        from numpy import arange
+        from PseudoNetCDF.camxfiles.FortranFileUtil import writeline
+        nt, nrxn = 2, 5
+        doms = [(1, 4, 1, 3, 1, 2), (2, 3, 2, 3, 1, 1)]
+        out = [writeline([b'irr test'], '80s'),
+               writeline([5185, 0., 5185, nt * 100.], 'ifif'),
+               writeline([1], 'i'),
+               writeline([0., 0., 4, 3, 1., 1., 0], 'ffiiffi'),
+               writeline([len(doms)], 'i')]
+        out += [writeline((1,) + dom, '7i') for dom in doms]
+        out += [writeline([nrxn], 'i')]
+        data_fmt = 'ifiiiii%df' % nrxn
+        allvals = []
+        start = 0
+        for pag, (i0, i1, j0, j1, k0, k1) in enumerate(doms):
+            shape = (nt, j1 + 1 - j0, i1 + 1 - i0, k1 + 1 - k0, nrxn)
+            size = nt * shape[1] * shape[2] * shape[3] * nrxn
+            vals = arange(start, start + size, dtype='f').reshape(shape)
+            start += size
+            allvals.append(vals)
+            for t in range(nt):
+                for j in range(j0, j1 + 1):
+                    for i in range(i0, i1 + 1):
+                        for k in range(k0, k1 + 1):
+                            kout = k + 1 if badk else k
+                            out.append(writeline(
+                                [5185, (t + 1) * 100., pag + 1, 0, i, j,
+                                 kout] +
+                                vals[t, j - j0, i - i0, k - k0].tolist(),
+                                data_fmt))
+        with open(path, 'wb') as outf:
+            outf.write(b''.join(out))
+        return allvals
+
+    def _open(self, path, **kwds):
+        from warnings import catch_warnings, simplefilter
+        with catch_warnings():
+            # small files warn that ipr_memmap is faster
+            simplefilter('ignore')
+            return irr(path, **kwds)
 
     def testIRR(self):
-        warn('Test not implemented; data too big for distribution')
+        import os
+        path = os.path.join(self.tmpdir, 'test.irr')
+        allvals = self._writeirr(path)
+        for validate in (False, True):
+            irrfile = self._open(path, validate=validate)
+            self.assertEqual(irrfile.NSTEPS, 2)
+            self.assertEqual(irrfile.NRXNS, 5)
+            tflag = irrfile.variables['TFLAG']
+            self.assertEqual(tflag.dimensions, ('TSTEP', 'VAR', 'DATE-TIME'))
+            self.assertEqual(tflag[:, 0].tolist(),
+                             [[5185, 100], [5185, 200]])
+            check = allvals[0].transpose(4, 0, 3, 1, 2)
+            for ri in range(5):
+                var = irrfile.variables['RXN_%02d' % (ri + 1)]
+                self.assertEqual(var.dimensions,
+                                 ('TSTEP', 'LAY', 'ROW', 'COL'))
+                self.assertEqual(var.shape, (2, 2, 3, 4))
+                self.assertTrue((var[:] == check[ri]).all())
+            self.assertRaises(ValueError, irrfile.loadVars, 1, 5, pagrid=1)
+
+    def testIRRValidate(self):
+        import os
+        path = os.path.join(self.tmpdir, 'badk.irr')
+        self._writeirr(path, badk=True)
+        irrfile = self._open(path)
+        irrfile.loadVars(1, 5)
+        irrfile = self._open(path, validate=True)
+        self.assertRaises(ValueError, irrfile.loadVars, 1, 5)
 
 
 if __name__ == '__main__':
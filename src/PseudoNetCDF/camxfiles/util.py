@@ -1,4 +1,4 @@
-__all__ = ['cartesian', 'sliceit']
+__all__ = ['cartesian', 'sliceit', 'advise_sequential']
 __doc__ = """
 .. _util
 :mod:`util` -- CAMx basic util
@@ -9,6 +9,7 @@ __doc__ = """
    :synopsis: Provides simple utilites for camxfiles
 .. moduleauthor:: Barron Henderson <barronh@unc.edu>
 """
+import mmap
 
 
 def cartesian(x, y):
@@ -32,3 +33,19 @@ def sliceit(args):
         return slice(*args)
     except TypeError:
         return slice(args, args + 1)
+
+
+def advise_sequential(mm):
+    """
+    Hint that the numpy.memmap mm will be read front to back so the
+    kernel reads ahead aggressively and can drop pages once used.
+    Does nothing where mmap.madvise is unavailable.
+    """
+    madvise = getattr(getattr(mm, '_mmap', None), 'madvise', None)
+    advice = getattr(mmap, 'MADV_SEQUENTIAL', None)
+    if madvise is None or advice is None:
+        return
+    try:
+        madvise(advice)
+    except (OSError, ValueError):
+        pass
@@ -2681,7 +2681,7 @@ class PseudoNetCDFVariables(OrderedDefaultDict):
         user has provided that key.  If so, call the user
         specifie function to create the variable.
         """
-        if k in self.keys():
+        if k in self.__keys:
             return self.__func(k)
         else:
             raise KeyError('missing "%s"' % (k, ))
@@ -2710,7 +2710,7 @@ class PseudoNetCDFVariables(OrderedDefaultDict):
         return [(k, self[k]) for k in self.keys()]
 
     def __contains__(self, k):
-        return k in [k for k in self.keys()]
+        return k in self.__keys or OrderedDict.__contains__(self, k)
 
 
 if __name__ == '__main__':
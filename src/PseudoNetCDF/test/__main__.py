@@ -40,7 +40,9 @@ addTestCasesFromModule(camxfiles.uamiv.Write)
 addTestCasesFromModule(camxfiles.point_source.Memmap)
 addTestCasesFromModule(camxfiles.lateral_boundary.Memmap)
 addTestCasesFromModule(camxfiles.ipr.Memmap)
+addTestCasesFromModule(camxfiles.ipr.Read)
 addTestCasesFromModule(camxfiles.irr.Memmap)
+addTestCasesFromModule(camxfiles.irr.Read)
 addTestCasesFromModule(camxfiles.FortranFileUtil)
 addTestCasesFromModule(camxfiles.timetuple)
 